@@ -6,296 +6,858 @@ Synchronise les factures et paiements depuis Axonaut vers Notion
 
 import os
 import sys
-import json
+import shlex
+import atexit
+import time
+import queue
+import logging
+import logging.handlers
+import hashlib
+import itertools
+import threading
 import subprocess
+import orjson
 import requests
-from datetime import datetime
-from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Configuration depuis variables d'environnement
 AXONAUT_API_KEY = os.getenv('AXONAUT_CABA_API_KEY')
 AXONAUT_API_BASE = "https://axonaut.com/api/v2"
+HTTP_TIMEOUT = 30
+# Garde-fou contre une pagination qui ne se termine jamais
+AXONAUT_MAX_PAGES = 1000
 
 # IDs des bases Notion (à configurer)
 NOTION_INVOICES_DB_ID = os.getenv('NOTION_INVOICES_DB_ID', '')
 NOTION_PAYMENTS_DB_ID = os.getenv('NOTION_PAYMENTS_DB_ID', '')
 
+# Accès Notion : API REST directe si un jeton d'intégration est fourni, sinon MCP
+NOTION_TOKEN = os.getenv('NOTION_TOKEN', '')
+NOTION_API_BASE = "https://api.notion.com/v1"
+NOTION_API_VERSION = "2022-06-28"
+
+# Commande de lancement d'un serveur MCP Notion exposant les mêmes outils que
+# manus-mcp-cli (notion-search-database, notion-create-page, notion-update-page).
+# Si vide, chaque appel passe par manus-mcp-cli
+NOTION_MCP_SERVER_CMD = os.getenv('NOTION_MCP_SERVER_CMD', '')
+MCP_PROTOCOL_VERSION = "2024-11-05"
+MCP_TIMEOUT = 30
+NOTION_PAGE_SIZE = 100
+
+# Propriété Notion (texte) contenant l'empreinte des données synchronisées
+SYNC_HASH_PROPERTY = "sync_hash"
+
 # Configuration
 DRY_RUN = os.getenv('DRY_RUN', 'false').lower() == 'true'
-LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOG_SUCCESS = 25
+SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', '8'))
+
+# Nombre d'échecs Notion consécutifs avant d'interrompre la synchronisation
+NOTION_MAX_CONSECUTIVE_FAILURES = 10
+
+# État persistant entre deux exécutions (ETag des pages Axonaut déjà synchronisées)
+SYNC_STATE_FILE = os.getenv(
+    'SYNC_STATE_FILE',
+    os.path.expanduser('~/.cache/axonaut_notion_sync/state.json')
+)
+
+
+@dataclass(slots=True)
+class Invoice:
+    """Facture Axonaut, décodée une seule fois à la récupération"""
+    id: Optional[int]
+    number: str
+    amount_ttc: float
+    amount_ht: float
+    date: str
+    due_date: str
+    status: str
+    client_reference: str
+    updated_at: Optional[str]
+    
+    @classmethod
+    def from_api(cls, data: Dict) -> "Invoice":
+        return cls(
+            id=data.get('id'),
+            number=str(data.get('number', '')),
+            amount_ttc=data.get('amount_ttc', 0),
+            amount_ht=data.get('amount_ht', 0),
+            date=data.get('date', ''),
+            due_date=data.get('due_date', ''),
+            status=data.get('status', 'Inconnu'),
+            client_reference=str(data.get('client_reference', '')),
+            updated_at=data.get('updated_at')
+        )
+
+
+@dataclass(slots=True)
+class Payment:
+    """Paiement Axonaut, décodé une seule fois à la récupération"""
+    id: Optional[int]
+    reference: str
+    invoice_id: Optional[int]
+    amount: float
+    date: str
+    nature: str
+    updated_at: Optional[str]
+    
+    @classmethod
+    def from_api(cls, data: Dict) -> "Payment":
+        return cls(
+            id=data.get('id'),
+            reference=str(data.get('reference', '')),
+            invoice_id=data.get('invoice_id'),
+            amount=data.get('amount', 0),
+            date=data.get('date', ''),
+            nature=data.get('nature', 'Autre'),
+            updated_at=data.get('updated_at')
+        )
+
+
+class PaginationError(Exception):
+    """Pagination Axonaut anormale : les pages suivantes n'ont pas pu être récupérées"""
 
 
 class AxonautAPI:
     """Client pour l'API Axonaut"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, etags: Optional[Dict[str, Dict]] = None):
         self.api_key = api_key
         self.base_url = AXONAUT_API_BASE
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        
+        # Session unique : connexions TCP/TLS réutilisées entre les appels
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=5,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504]
+            )
+        )
+        self.session.mount("https://", adapter)
+        
+        # ETag connus (exécution précédente) et ETag vus pendant cette exécution
+        self.etags = etags or {}
+        self.seen_etags = {}
     
-    def get_invoices(self, limit: int = 100) -> List[Dict]:
-        """Récupère les factures depuis Axonaut"""
+    @staticmethod
+    def _parse_page(response: requests.Response) -> List[Dict]:
+        """Décode une page Axonaut, qui doit être une liste d'objets JSON
+
+        Une page de maintenance HTML ou un objet d'erreur lève
+        requests.exceptions.InvalidJSONError, traitée comme un échec d'Axonaut.
+        """
         try:
-            response = requests.get(
-                f"{self.base_url}/invoices",
-                headers=self.headers,
-                params={"limit": limit}
+            data = orjson.loads(response.content)
+        except orjson.JSONDecodeError as e:
+            raise requests.exceptions.InvalidJSONError(f"JSON invalide : {e}", response=response) from e
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            raise requests.exceptions.InvalidJSONError(
+                f"liste d'objets attendue, reçu {type(data).__name__}", response=response
             )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            log_error(f"Erreur lors de la récupération des factures: {e}")
-            return []
+        return data
     
-    def get_payments(self, invoice_id: Optional[int] = None) -> List[Dict]:
-        """Récupère les paiements depuis Axonaut"""
-        try:
-            params = {}
-            if invoice_id:
-                params['invoice_id'] = invoice_id
+    def _iter_pages(self, endpoint: str, params: Dict, page_size: int, label: str) -> Iterator[Dict]:
+        """Parcourt un endpoint paginé et renvoie les éléments au fil de l'eau
+
+        Lève requests.exceptions.RequestException si Axonaut reste injoignable
+        après les nouvelles tentatives ou renvoie une page illisible, et
+        PaginationError si la pagination ne progresse plus ou ne se termine pas.
+        """
+        page = 1
+        seen_ids = set()
+        while page <= AXONAUT_MAX_PAGES:
+            page_params = {**params, "limit": page_size}
+            key = endpoint + "?" + "&".join(
+                f"{k}={v}" for k, v in sorted({**page_params, "page": page}.items())
+            )
+            known = self.etags.get(key)
+            
+            # Axonaut pagine via l'en-tête « page », pas via un paramètre d'URL
+            headers = {"page": str(page)}
+            if known:
+                headers["If-None-Match"] = known["etag"]
+            
+            try:
+                response = self.session.get(
+                    f"{self.base_url}/{endpoint}",
+                    params=page_params,
+                    headers=headers,
+                    timeout=HTTP_TIMEOUT
+                )
+                response.raise_for_status()
+                data = None if response.status_code == 304 else self._parse_page(response)
+            except requests.exceptions.RequestException as e:
+                log_error(f"Erreur lors de la récupération des {label} (page {page}): {e}")
+                raise
+            
+            if data is None:
+                # Page inchangée depuis la dernière synchronisation réussie
+                log_info(f"Page {page} des {label} inchangée")
+                self.seen_etags[key] = known
+                count = known["count"]
+            else:
+                ids = {item.get('id') for item in data}
+                if data and ids <= seen_ids:
+                    # Page déjà reçue : Axonaut ignore la pagination, inutile d'insister
+                    raise PaginationError(f"page {page} des {label} identique aux précédentes")
+                seen_ids |= ids
+                
+                count = len(data)
+                if response.headers.get("ETag"):
+                    self.seen_etags[key] = {"etag": response.headers["ETag"], "count": count}
+                yield from data
             
-            response = requests.get(
-                f"{self.base_url}/payments",
-                headers=self.headers,
-                params=params
+            if count < page_size:
+                return
+            page += 1
+        
+        raise PaginationError(f"plus de {AXONAUT_MAX_PAGES} pages de {label}")
+    
+    def iter_invoices(self, page_size: int = 100) -> Iterator[Invoice]:
+        """Récupère les factures depuis Axonaut, page par page"""
+        return map(Invoice.from_api, self._iter_pages("invoices", {}, page_size, "factures"))
+    
+    def iter_payments(self, invoice_id: Optional[int] = None, page_size: int = 100) -> Iterator[Payment]:
+        """Récupère les paiements depuis Axonaut, page par page"""
+        params = {}
+        if invoice_id:
+            params['invoice_id'] = invoice_id
+        
+        return map(Payment.from_api, self._iter_pages("payments", params, page_size, "paiements"))
+
+
+class CircuitOpenError(Exception):
+    """Trop de pannes Notion consécutives : la synchronisation est interrompue"""
+
+
+class NotionClient(ABC):
+    """Base commune aux clients Notion (API REST ou MCP)"""
+    
+    def __init__(self):
+        self._consecutive_failures = 0
+        self._failures_lock = threading.Lock()
+    
+    def _check_circuit(self):
+        """Refuse tout nouvel appel une fois le seuil d'échecs atteint"""
+        if self._consecutive_failures >= NOTION_MAX_CONSECUTIVE_FAILURES:
+            raise CircuitOpenError(f"{self._consecutive_failures} échecs Notion consécutifs")
+    
+    def _record(self, result: Optional[Dict], outage: bool = False) -> Optional[Dict]:
+        """Comptabilise le résultat d'un appel
+
+        Seules les pannes (réseau, délai dépassé, 5xx, 429 persistant) comptent
+        pour le disjoncteur. Un enregistrement refusé par Notion (4xx) échoue
+        seul : Notion a répondu, le compteur repart à zéro.
+        """
+        with self._failures_lock:
+            if outage:
+                self._consecutive_failures += 1
+            else:
+                self._consecutive_failures = 0
+        self._check_circuit()
+        return result
+    
+    @abstractmethod
+    def query_database(self, database_id: str, body: Dict) -> Optional[Dict]:
+        """Interroge une base Notion (filtre, pagination)"""
+    
+    @abstractmethod
+    def create_page(self, database_id: str, properties: Dict) -> Optional[Dict]:
+        """Crée une page dans Notion"""
+    
+    @abstractmethod
+    def update_page(self, page_id: str, properties: Dict) -> Optional[Dict]:
+        """Met à jour une page dans Notion"""
+    
+    def find_pages(self, database_id: str, id_property: str, axonaut_ids: List[int]) -> Optional[Dict[int, Tuple[str, str]]]:
+        """Recherche en une requête les pages d'un lot d'IDs Axonaut → (page_id, sync_hash)
+
+        Renvoie None en cas d'erreur.
+        """
+        index = {}
+        body = {
+            "filter": {"or": [
+                {"property": id_property, "number": {"equals": axonaut_id}}
+                for axonaut_id in axonaut_ids
+            ]},
+            "page_size": NOTION_PAGE_SIZE
+        }
+        
+        while True:
+            result = self.query_database(database_id, body)
+            if result is None:
+                return None
+            
+            for page in result.get('results', []):
+                properties = page['properties']
+                axonaut_id = properties[id_property]['number']
+                if axonaut_id is not None:
+                    sync_hash = "".join(
+                        t.get('plain_text') or t['text']['content']
+                        for t in properties.get(SYNC_HASH_PROPERTY, {}).get('rich_text', [])
+                    )
+                    index[int(axonaut_id)] = (page['id'], sync_hash)
+            
+            if not result.get('has_more'):
+                return index
+            body["start_cursor"] = result['next_cursor']
+
+
+class NotionAPI(NotionClient):
+    """Client pour l'API REST Notion (appels HTTP directs, sans MCP)"""
+    
+    def __init__(self, token: str):
+        super().__init__()
+        self.base_url = NOTION_API_BASE
+        
+        self.headers = {
+            "Authorization": f"Bearer {token}",
+            "Notion-Version": NOTION_API_VERSION,
+            "Content-Type": "application/json"
+        }
+        
+        # Requêtes idempotentes (recherche, mise à jour) : nouvelle tentative
+        # sur erreur réseau, 429 et erreurs de passerelle
+        self.session = self._build_session(Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=None
+        ))
+        # Créations (POST /pages) : une nouvelle tentative après envoi pourrait
+        # créer un doublon si Notion a déjà enregistré la page. On ne réessaie
+        # donc que sur 429 et sur les erreurs de connexion (requête non envoyée).
+        self.create_session = self._build_session(Retry(
+            total=3,
+            read=0,
+            other=0,
+            backoff_factor=0.3,
+            status_forcelist=[429],
+            allowed_methods=None
+        ))
+    
+    def _build_session(self, retry: Retry) -> requests.Session:
+        """Crée une session réutilisant les connexions TCP/TLS entre les workers"""
+        session = requests.Session()
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max(SYNC_CONCURRENCY, 1),
+            max_retries=retry
+        )
+        session.mount("https://", adapter)
+        return session
+    
+    def _call(self, method: str, path: str, body: Dict, idempotent: bool = True) -> Optional[Dict]:
+        """Envoie une requête à l'API Notion et renvoie la réponse décodée"""
+        self._check_circuit()
+        session = self.session if idempotent else self.create_session
+        try:
+            response = session.request(
+                method,
+                f"{self.base_url}/{path}",
+                data=orjson.dumps(body),
+                timeout=HTTP_TIMEOUT
             )
             response.raise_for_status()
-            return response.json()
+            return self._record(orjson.loads(response.content))
+        except requests.exceptions.HTTPError as e:
+            log_error(f"Erreur API Notion ({method} /{path}): {e} {e.response.text[:300]}")
+            return self._record(None, outage=e.response.status_code >= 500)
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.RetryError) as e:
+            # Notion injoignable, ou 429/5xx persistant malgré les nouvelles tentatives
+            log_error(f"Erreur API Notion ({method} /{path}): {e}")
+            return self._record(None, outage=True)
         except requests.exceptions.RequestException as e:
-            log_error(f"Erreur lors de la récupération des paiements: {e}")
-            return []
+            log_error(f"Erreur API Notion ({method} /{path}): {e}")
+            return self._record(None)
+        except orjson.JSONDecodeError as e:
+            log_error(f"Erreur de parsing JSON: {e}")
+            return self._record(None)
+    
+    def query_database(self, database_id: str, body: Dict) -> Optional[Dict]:
+        """Interroge une base Notion (filtre, pagination)"""
+        return self._call("POST", f"databases/{database_id}/query", body)
+    
+    def create_page(self, database_id: str, properties: Dict) -> Optional[Dict]:
+        """Crée une page dans Notion"""
+        return self._call("POST", "pages", {
+            "parent": {"database_id": database_id},
+            "properties": properties
+        }, idempotent=False)
+    
+    def update_page(self, page_id: str, properties: Dict) -> Optional[Dict]:
+        """Met à jour une page dans Notion"""
+        return self._call("PATCH", f"pages/{page_id}", {"properties": properties})
 
 
-class NotionMCP:
-    """Client pour Notion via MCP"""
+class NotionMCP(NotionClient):
+    """Client pour Notion via MCP
+
+    Si NOTION_MCP_SERVER_CMD est défini, le serveur MCP Notion est lancé une
+    seule fois et les appels d'outils transitent en JSON-RPC sur son
+    stdin/stdout. Sinon, chaque appel passe par manus-mcp-cli.
+    """
     
-    @staticmethod
-    def call_mcp_tool(tool_name: str, arguments: Dict) -> Optional[Dict]:
-        """Appelle un outil MCP Notion"""
-        try:
+    def __init__(self, server_cmd: str = NOTION_MCP_SERVER_CMD):
+        super().__init__()
+        self.proc = None
+        self._request_id = 0
+        # Le serveur persistant est partagé entre les workers : un échange à la fois
+        self._lock = threading.Lock()
+        if server_cmd:
+            self._start_server(server_cmd)
+    
+    def _start_server(self, server_cmd: str):
+        """Lance le serveur MCP persistant et effectue la poignée de main"""
+        self.proc = subprocess.Popen(
+            shlex.split(server_cmd),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        atexit.register(self.proc.terminate)
+        
+        # Lecture des réponses dans un thread dédié, pour pouvoir attendre avec un délai
+        self._responses = queue.SimpleQueue()
+        threading.Thread(target=self._read_responses, daemon=True).start()
+        
+        self._request("initialize", {
+            "protocolVersion": MCP_PROTOCOL_VERSION,
+            "capabilities": {},
+            "clientInfo": {"name": "axonaut-notion-sync", "version": "1.0"}
+        })
+        self._send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+    
+    def _read_responses(self):
+        """Transmet chaque ligne du stdout du serveur à la file des réponses"""
+        for line in self.proc.stdout:
+            self._responses.put(line)
+        self._responses.put(None)
+    
+    def _send(self, message: Dict):
+        """Écrit un message JSON-RPC (une ligne) sur le stdin du serveur"""
+        self.proc.stdin.write(orjson.dumps(message) + b"\n")
+        self.proc.stdin.flush()
+    
+    def _request(self, method: str, params: Dict) -> Dict:
+        """Envoie une requête JSON-RPC et attend la réponse correspondante"""
+        self._request_id += 1
+        request_id = self._request_id
+        self._send({
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "method": method,
+            "params": params
+        })
+        
+        deadline = time.monotonic() + MCP_TIMEOUT
+        while True:
+            try:
+                line = self._responses.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                # Serveur bloqué : on l'arrête pour que les appels suivants échouent aussitôt
+                self.proc.kill()
+                raise TimeoutError(f"Pas de réponse du serveur MCP après {MCP_TIMEOUT}s")
+            if line is None:
+                raise ConnectionError("Le serveur MCP s'est arrêté")
+            message = orjson.loads(line)
+            # Les notifications du serveur n'ont pas d'id : on les ignore
+            if message.get("id") == request_id:
+                break
+        
+        if "error" in message:
+            raise RuntimeError(message["error"].get("message", message["error"]))
+        return message.get("result", {})
+    
+    def _rpc(self, tool_name: str, arguments: Dict) -> Optional[Dict]:
+        """Exécute un outil MCP via le serveur persistant ou manus-mcp-cli"""
+        if self.proc is None:
             cmd = [
                 "manus-mcp-cli",
                 "tool", "call",
                 tool_name,
                 "--server", "notion",
-                "--input", json.dumps(arguments)
+                "--input", orjson.dumps(arguments).decode()
             ]
             
             result = subprocess.run(
                 cmd,
                 capture_output=True,
-                text=True,
                 check=True
             )
             
             if result.stdout:
-                return json.loads(result.stdout)
+                return orjson.loads(result.stdout)
             return None
+        
+        with self._lock:
+            result = self._request("tools/call", {
+                "name": tool_name,
+                "arguments": arguments
+            })
+        texts = [c["text"] for c in result.get("content", []) if c.get("type") == "text"]
+        if result.get("isError"):
+            raise RuntimeError(" ".join(texts))
+        return orjson.loads(texts[0]) if texts else None
+    
+    def call_mcp_tool(self, tool_name: str, arguments: Dict) -> Optional[Dict]:
+        """Appelle un outil MCP Notion"""
+        self._check_circuit()
+        try:
+            return self._record(self._rpc(tool_name, arguments))
             
         except subprocess.CalledProcessError as e:
-            log_error(f"Erreur MCP pour {tool_name}: {e.stderr}")
-            return None
-        except json.JSONDecodeError as e:
+            # manus-mcp-cli ne distingue pas une panne Notion d'un refus : tout
+            # échec compte pour le disjoncteur, sans quoi il ne se déclencherait jamais
+            log_error(f"Erreur MCP pour {tool_name}: {e.stderr.decode(errors='replace')}")
+            return self._record(None, outage=True)
+        except orjson.JSONDecodeError as e:
             log_error(f"Erreur de parsing JSON: {e}")
-            return None
+            return self._record(None)
+        except OSError as e:
+            # Serveur MCP arrêté, bloqué ou impossible à lancer
+            log_error(f"Erreur MCP pour {tool_name}: {e}")
+            return self._record(None, outage=True)
+        except RuntimeError as e:
+            # Erreur renvoyée par l'outil (ex. propriétés refusées par Notion)
+            log_error(f"Erreur MCP pour {tool_name}: {e}")
+            return self._record(None)
     
-    @staticmethod
-    def search_database(database_id: str, filter_conditions: Dict) -> List[Dict]:
-        """Recherche dans une base Notion"""
-        arguments = {
-            "database_id": database_id,
-            "filter": filter_conditions
-        }
-        
-        result = NotionMCP.call_mcp_tool("notion-search-database", arguments)
-        return result.get('results', []) if result else []
+    def query_database(self, database_id: str, body: Dict) -> Optional[Dict]:
+        """Interroge une base Notion (filtre, pagination)"""
+        return self.call_mcp_tool("notion-search-database", {"database_id": database_id, **body})
     
-    @staticmethod
-    def create_page(database_id: str, properties: Dict) -> Optional[Dict]:
+    def create_page(self, database_id: str, properties: Dict) -> Optional[Dict]:
         """Crée une page dans Notion"""
         arguments = {
             "database_id": database_id,
             "properties": properties
         }
         
-        return NotionMCP.call_mcp_tool("notion-create-page", arguments)
+        return self.call_mcp_tool("notion-create-page", arguments)
     
-    @staticmethod
-    def update_page(page_id: str, properties: Dict) -> Optional[Dict]:
+    def update_page(self, page_id: str, properties: Dict) -> Optional[Dict]:
         """Met à jour une page dans Notion"""
         arguments = {
             "page_id": page_id,
             "properties": properties
         }
         
-        return NotionMCP.call_mcp_tool("notion-update-page", arguments)
+        return self.call_mcp_tool("notion-update-page", arguments)
+
+
+logger = logging.getLogger("axonaut_notion_sync")
+logging.addLevelName(LOG_SUCCESS, "✅ SUCCESS")
+
+
+def setup_logging():
+    """Configure les logs : les workers déposent leurs messages dans une file,
+    un thread dédié les écrit (stdout, et stderr pour les erreurs)"""
+    if logger.handlers:
+        # Déjà configuré (main() appelé plusieurs fois dans le même processus)
+        return
+    
+    formatter = logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s", LOG_TIME_FORMAT)
+    
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.addFilter(lambda record: record.levelno < logging.ERROR)
+    stdout_handler.setFormatter(formatter)
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setLevel(logging.ERROR)
+    stderr_handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stdout_handler, stderr_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    level = logging.getLevelName(LOG_LEVEL)
+    logger.setLevel(level if isinstance(level, int) else logging.INFO)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
 
 
 def log_info(message: str):
     """Log un message d'information"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] INFO: {message}")
+    logger.info(message)
 
 
 def log_error(message: str):
     """Log un message d'erreur"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] ERROR: {message}", file=sys.stderr)
+    logger.error(message)
 
 
 def log_success(message: str):
     """Log un message de succès"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] ✅ SUCCESS: {message}")
+    logger.log(LOG_SUCCESS, message)
 
 
-def format_invoice_properties(invoice: Dict) -> Dict:
+def format_invoice_properties(invoice: Invoice) -> Dict:
     """Formate les propriétés d'une facture pour Notion"""
     return {
         "Numéro": {
-            "title": [{"text": {"content": str(invoice.get('number', ''))}}]
+            "title": [{"text": {"content": invoice.number}}]
         },
         "ID Facture Axonaut": {
-            "number": invoice.get('id')
+            "number": invoice.id
         },
         "Montant TTC": {
-            "number": invoice.get('amount_ttc', 0)
+            "number": invoice.amount_ttc
         },
         "Montant HT": {
-            "number": invoice.get('amount_ht', 0)
+            "number": invoice.amount_ht
         },
         "Date Facture": {
-            "date": {"start": invoice.get('date', '')}
+            "date": {"start": invoice.date}
         },
         "Date Échéance": {
-            "date": {"start": invoice.get('due_date', '')}
+            "date": {"start": invoice.due_date}
         },
         "Statut": {
-            "select": {"name": invoice.get('status', 'Inconnu')}
+            "select": {"name": invoice.status}
         },
         "Référence Client": {
-            "rich_text": [{"text": {"content": str(invoice.get('client_reference', ''))}}]
+            "rich_text": [{"text": {"content": invoice.client_reference}}]
         }
     }
 
 
-def format_payment_properties(payment: Dict) -> Dict:
+def format_payment_properties(payment: Payment) -> Dict:
     """Formate les propriétés d'un paiement pour Notion"""
     return {
         "Référence": {
-            "title": [{"text": {"content": str(payment.get('reference', ''))}}]
+            "title": [{"text": {"content": payment.reference}}]
         },
         "ID Paiement Axonaut": {
-            "number": payment.get('id')
+            "number": payment.id
         },
         "ID Facture Axonaut": {
-            "number": payment.get('invoice_id')
+            "number": payment.invoice_id
         },
         "Montant": {
-            "number": payment.get('amount', 0)
+            "number": payment.amount
         },
         "Date Paiement": {
-            "date": {"start": payment.get('date', '')}
+            "date": {"start": payment.date}
         },
         "Méthode": {
-            "select": {"name": payment.get('nature', 'Autre')}
+            "select": {"name": payment.nature}
         }
     }
 
 
-def sync_invoice(axonaut: AxonautAPI, invoice: Dict) -> bool:
+def hash_properties(properties: Dict, updated_at: Optional[str]) -> str:
+    """Calcule l'empreinte stable des propriétés formatées d'un enregistrement"""
+    payload = orjson.dumps([properties, updated_at], option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def sync_invoice(notion: NotionClient, invoice: Invoice, index: Dict[int, Tuple[str, str]], *,
+                 db_id: str = NOTION_INVOICES_DB_ID, dry: bool = DRY_RUN) -> bool:
     """Synchronise une facture vers Notion"""
-    invoice_id = invoice.get('id')
-    invoice_number = invoice.get('number', 'N/A')
+    invoice_id = invoice.id
+    invoice_number = invoice.number or 'N/A'
     
     log_info(f"Synchronisation de la facture {invoice_number} (ID: {invoice_id})")
     
-    if DRY_RUN:
+    if dry:
         log_info(f"[DRY RUN] Facture {invoice_number} serait synchronisée")
         return True
     
     try:
-        # Vérifier si la facture existe déjà dans Notion
-        existing = NotionMCP.search_database(
-            NOTION_INVOICES_DB_ID,
-            {
-                "property": "ID Facture Axonaut",
-                "number": {"equals": invoice_id}
-            }
-        )
-        
         properties = format_invoice_properties(invoice)
+        sync_hash = hash_properties(properties, invoice.updated_at)
+        
+        # Vérifier si la facture existe déjà dans Notion (index préchargé)
+        existing = index.get(invoice_id)
+        if existing and existing[1] == sync_hash:
+            log_info(f"Facture {invoice_number} inchangée")
+            return True
+        
+        properties[SYNC_HASH_PROPERTY] = {"rich_text": [{"text": {"content": sync_hash}}]}
         
         if existing:
             # Mise à jour
-            page_id = existing[0]['id']
-            result = NotionMCP.update_page(page_id, properties)
+            result = notion.update_page(existing[0], properties)
             if result:
                 log_success(f"Facture {invoice_number} mise à jour")
                 return True
         else:
             # Création
-            result = NotionMCP.create_page(NOTION_INVOICES_DB_ID, properties)
+            result = notion.create_page(db_id, properties)
             if result:
                 log_success(f"Facture {invoice_number} créée")
                 return True
         
         return False
         
+    except CircuitOpenError:
+        raise
     except Exception as e:
         log_error(f"Erreur lors de la synchronisation de la facture {invoice_number}: {e}")
         return False
 
 
-def sync_payment(payment: Dict) -> bool:
+def sync_payment(notion: NotionClient, payment: Payment, index: Dict[int, Tuple[str, str]], *,
+                 db_id: str = NOTION_PAYMENTS_DB_ID, dry: bool = DRY_RUN) -> bool:
     """Synchronise un paiement vers Notion"""
-    payment_id = payment.get('id')
-    payment_ref = payment.get('reference', 'N/A')
+    payment_id = payment.id
+    payment_ref = payment.reference or 'N/A'
     
     log_info(f"Synchronisation du paiement {payment_ref} (ID: {payment_id})")
     
-    if DRY_RUN:
+    if dry:
         log_info(f"[DRY RUN] Paiement {payment_ref} serait synchronisé")
         return True
     
     try:
-        # Vérifier si le paiement existe déjà dans Notion
-        existing = NotionMCP.search_database(
-            NOTION_PAYMENTS_DB_ID,
-            {
-                "property": "ID Paiement Axonaut",
-                "number": {"equals": payment_id}
-            }
-        )
-        
         properties = format_payment_properties(payment)
+        sync_hash = hash_properties(properties, payment.updated_at)
+        
+        # Vérifier si le paiement existe déjà dans Notion (index préchargé)
+        existing = index.get(payment_id)
+        if existing and existing[1] == sync_hash:
+            log_info(f"Paiement {payment_ref} inchangé")
+            return True
+        
+        properties[SYNC_HASH_PROPERTY] = {"rich_text": [{"text": {"content": sync_hash}}]}
         
         if existing:
             # Mise à jour
-            page_id = existing[0]['id']
-            result = NotionMCP.update_page(page_id, properties)
+            result = notion.update_page(existing[0], properties)
             if result:
                 log_success(f"Paiement {payment_ref} mis à jour")
                 return True
         else:
             # Création
-            result = NotionMCP.create_page(NOTION_PAYMENTS_DB_ID, properties)
+            result = notion.create_page(db_id, properties)
             if result:
                 log_success(f"Paiement {payment_ref} créé")
                 return True
         
         return False
         
+    except CircuitOpenError:
+        raise
     except Exception as e:
         log_error(f"Erreur lors de la synchronisation du paiement {payment_ref}: {e}")
         return False
 
 
+def load_state(path: str = SYNC_STATE_FILE) -> Dict:
+    """Charge l'état de la dernière synchronisation réussie"""
+    try:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except (OSError, orjson.JSONDecodeError) as e:
+        log_error(f"État de synchronisation illisible ({path}), ignoré: {e}")
+        return {}
+
+
+def save_state(state: Dict, path: str = SYNC_STATE_FILE):
+    """Enregistre l'état de la synchronisation"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(state))
+    except OSError as e:
+        log_error(f"Impossible d'enregistrer l'état de synchronisation ({path}): {e}")
+
+
+def state_etags(state: Dict, databases: Dict[str, str]) -> Dict[str, Dict]:
+    """Renvoie les ETag enregistrés, s'ils ont été obtenus pour les mêmes bases Notion
+
+    Après un changement de base, les pages Axonaut inchangées doivent tout de
+    même être écrites dans la nouvelle base : les ETag sont alors ignorés.
+    """
+    if state.get("databases") != databases:
+        if state.get("etags"):
+            log_info("Bases Notion différentes de la dernière synchronisation : ETag ignorés")
+        return {}
+    return state.get("etags", {})
+
+
+def iter_chunks(records: Iterable, size: int) -> Iterator[List]:
+    """Regroupe un flux d'enregistrements en lots de taille fixe"""
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def submit_records(executor: ThreadPoolExecutor, notion: NotionClient, records: Iterable,
+                   sync_record: Callable, database_id: str, id_property: str, *,
+                   dry: bool = DRY_RUN) -> Tuple[List[Future], int]:
+    """Soumet les enregistrements aux workers, avec une seule recherche Notion par lot
+
+    Un même ID Axonaut n'est soumis qu'une fois par exécution : la pagination peut
+    renvoyer un enregistrement sur deux pages, et deux créations concurrentes
+    produiraient un doublon dans Notion.
+
+    Renvoie les futures et le nombre d'enregistrements en échec avant soumission
+    (sans ID Axonaut, ou dont la recherche a échoué).
+    """
+    futures = []
+    lookup_failed = 0
+    submitted_ids = set()
+    
+    for chunk in iter_chunks(records, NOTION_PAGE_SIZE):
+        fresh = []
+        for record in chunk:
+            if record.id is None:
+                # Un filtre sur None ferait rejeter par Notion la recherche de tout le lot
+                log_error(f"Enregistrement Axonaut sans ID ignoré: {record}")
+                lookup_failed += 1
+                continue
+            if record.id in submitted_ids:
+                log_info(f"ID Axonaut {record.id} déjà reçu, ignoré")
+                continue
+            submitted_ids.add(record.id)
+            fresh.append(record)
+        if not fresh:
+            continue
+        
+        index = {}
+        if not dry:
+            index = notion.find_pages(database_id, id_property, [record.id for record in fresh])
+            if index is None:
+                log_error(f"Impossible de rechercher {len(fresh)} enregistrements dans Notion")
+                lookup_failed += len(fresh)
+                continue
+        
+        futures.extend(
+            executor.submit(sync_record, notion, record, index, db_id=database_id, dry=dry)
+            for record in fresh
+        )
+    
+    return futures, lookup_failed
+
+
 def main():
     """Fonction principale de synchronisation"""
+    setup_logging()
+    
     log_info("=" * 60)
     log_info("Démarrage de la synchronisation Axonaut → Notion")
     log_info("=" * 60)
@@ -309,11 +871,19 @@ def main():
         log_error("IDs des bases Notion non définis")
         sys.exit(1)
     
-    if DRY_RUN:
+    # Lu une seule fois et transmis jusqu'aux fonctions de synchronisation
+    dry = DRY_RUN
+    if dry:
         log_info("⚠️  MODE DRY RUN ACTIVÉ - Aucune modification ne sera effectuée")
     
-    # Initialisation du client Axonaut
-    axonaut = AxonautAPI(AXONAUT_API_KEY)
+    # Initialisation des clients Axonaut et Notion
+    databases = {"invoices": NOTION_INVOICES_DB_ID, "payments": NOTION_PAYMENTS_DB_ID}
+    axonaut = AxonautAPI(AXONAUT_API_KEY, etags=state_etags(load_state(), databases))
+    try:
+        notion = NotionAPI(NOTION_TOKEN) if NOTION_TOKEN else NotionMCP()
+    except (OSError, RuntimeError, orjson.JSONDecodeError) as e:
+        log_error(f"Impossible de démarrer le serveur MCP Notion: {e}")
+        sys.exit(1)
     
     # Statistiques
     stats = {
@@ -323,27 +893,46 @@ def main():
         "payments_failed": 0
     }
     
-    # Synchronisation des factures
-    log_info("Récupération des factures depuis Axonaut...")
-    invoices = axonaut.get_invoices()
-    log_info(f"✓ {len(invoices)} factures récupérées")
-    
-    for invoice in invoices:
-        if sync_invoice(axonaut, invoice):
-            stats["invoices_synced"] += 1
-        else:
-            stats["invoices_failed"] += 1
-    
-    # Synchronisation des paiements
-    log_info("Récupération des paiements depuis Axonaut...")
-    payments = axonaut.get_payments()
-    log_info(f"✓ {len(payments)} paiements récupérés")
-    
-    for payment in payments:
-        if sync_payment(payment):
-            stats["payments_synced"] += 1
-        else:
-            stats["payments_failed"] += 1
+    executor = ThreadPoolExecutor(max_workers=SYNC_CONCURRENCY)
+    try:
+        # Factures puis paiements alimentent le même pool : la récupération des
+        # paiements démarre pendant que les workers synchronisent encore les factures.
+        # L'existence dans Notion est vérifiée par lots de 100 au fil du flux.
+        log_info("Récupération des factures depuis Axonaut...")
+        invoice_futures, stats["invoices_failed"] = submit_records(
+            executor, notion, axonaut.iter_invoices(), sync_invoice,
+            NOTION_INVOICES_DB_ID, "ID Facture Axonaut", dry=dry
+        )
+        log_info(f"✓ {len(invoice_futures) + stats['invoices_failed']} factures récupérées")
+        
+        log_info("Récupération des paiements depuis Axonaut...")
+        payment_futures, stats["payments_failed"] = submit_records(
+            executor, notion, axonaut.iter_payments(), sync_payment,
+            NOTION_PAYMENTS_DB_ID, "ID Paiement Axonaut", dry=dry
+        )
+        log_info(f"✓ {len(payment_futures) + stats['payments_failed']} paiements récupérés")
+        
+        futures = dict.fromkeys(invoice_futures, "invoices")
+        futures.update(dict.fromkeys(payment_futures, "payments"))
+        
+        for future in as_completed(futures):
+            kind = futures[future]
+            if future.result():
+                stats[f"{kind}_synced"] += 1
+            else:
+                stats[f"{kind}_failed"] += 1
+    except requests.exceptions.RequestException:
+        log_error("Axonaut injoignable ou réponse invalide : synchronisation interrompue")
+        sys.exit(2)
+    except PaginationError as e:
+        log_error(f"Pagination Axonaut anormale ({e}) : synchronisation interrompue")
+        sys.exit(2)
+    except CircuitOpenError as e:
+        log_error(f"Notion indisponible ({e}) : synchronisation interrompue")
+        sys.exit(2)
+    finally:
+        # En cas d'interruption, les synchronisations pas encore démarrées sont annulées
+        executor.shutdown(cancel_futures=True)
     
     # Rapport final
     log_info("=" * 60)
@@ -359,6 +948,9 @@ def main():
     if stats["invoices_failed"] > 0 or stats["payments_failed"] > 0:
         sys.exit(1)
     else:
+        # Les ETag ne sont conservés qu'après une synchronisation complète
+        if not dry:
+            save_state({"databases": databases, "etags": axonaut.seen_etags})
         sys.exit(0)
 
 
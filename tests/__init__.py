@@ -0,0 +1,27 @@
+"""Outils communs aux tests de la synchronisation Axonaut → Notion"""
+
+import unittest
+from unittest import mock
+
+import requests
+
+import sync_axonaut_notion as sync
+
+
+def make_response(status=200, body=b"", headers=None, url="https://example.test"):
+    """Construit une vraie réponse requests, sans passer par le réseau"""
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    response.url = url
+    return response
+
+
+class SyncTestCase(unittest.TestCase):
+    """Base des tests : les logs du script sont coupés"""
+
+    def setUp(self):
+        patcher = mock.patch.object(sync.logger, "disabled", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
@@ -0,0 +1,74 @@
+"""Tests de la pagination Axonaut : une réponse ou une pagination anormale interrompt la synchronisation"""
+
+import unittest
+from unittest import mock
+
+import requests
+
+import sync_axonaut_notion as sync
+from tests import SyncTestCase, make_response
+
+
+class AxonautPayloadTest(SyncTestCase):
+
+    def fetch(self, body):
+        axonaut = sync.AxonautAPI("key")
+        axonaut.session.get = mock.Mock(return_value=make_response(200, body))
+        return list(axonaut._iter_pages("invoices", {}, 100, "factures"))
+
+    def test_html_page_raises_request_exception(self):
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.fetch(b"<html>Maintenance en cours</html>")
+
+    def test_error_object_raises_request_exception(self):
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.fetch(b'{"error": "Invalid API key"}')
+
+    def test_invalid_payload_exits_2(self):
+        axonaut = sync.AxonautAPI("key")
+        axonaut.session.get = mock.Mock(return_value=make_response(200, b"<html></html>"))
+
+        with mock.patch.multiple(
+            sync,
+            AXONAUT_API_KEY="key",
+            NOTION_TOKEN="token",
+            NOTION_INVOICES_DB_ID="db-inv",
+            NOTION_PAYMENTS_DB_ID="db-pay",
+            DRY_RUN=False,
+            setup_logging=mock.Mock(),
+            load_state=mock.Mock(return_value={}),
+            save_state=mock.Mock(),
+            AxonautAPI=mock.Mock(return_value=axonaut),
+            NotionAPI=mock.Mock(),
+        ):
+            with self.assertRaises(SystemExit) as exit_info:
+                sync.main()
+            sync.save_state.assert_not_called()
+
+        self.assertEqual(exit_info.exception.code, 2)
+
+
+class AxonautPaginationTest(SyncTestCase):
+
+    def test_repeated_page_raises(self):
+        axonaut = sync.AxonautAPI("key")
+        axonaut.session.get = mock.Mock(return_value=make_response(200, b'[{"id": 1}, {"id": 2}]'))
+
+        with self.assertRaises(sync.PaginationError):
+            list(axonaut._iter_pages("invoices", {}, 2, "factures"))
+        self.assertEqual(axonaut.session.get.call_count, 2)
+
+    def test_page_limit_raises(self):
+        axonaut = sync.AxonautAPI("key")
+        axonaut.session.get = mock.Mock(side_effect=lambda *args, headers, **kwargs: make_response(
+            200, f'[{{"id": {headers["page"]}}}]'.encode()
+        ))
+
+        with mock.patch.object(sync, "AXONAUT_MAX_PAGES", 3):
+            with self.assertRaises(sync.PaginationError):
+                list(axonaut._iter_pages("invoices", {}, 1, "factures"))
+        self.assertEqual(axonaut.session.get.call_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests du disjoncteur Notion : seules les pannes interrompent la synchronisation"""
+
+import subprocess
+import unittest
+from unittest import mock
+
+import requests
+
+import sync_axonaut_notion as sync
+from tests import SyncTestCase, make_response
+
+
+class NotionCircuitTest(SyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.notion = sync.NotionAPI("token")
+
+    def create_pages(self, count):
+        for _ in range(count):
+            self.notion.create_page("db", {})
+
+    def test_rejected_records_do_not_open_circuit(self):
+        self.notion.create_session.request = mock.Mock(
+            return_value=make_response(400, b'{"message": "date.start should be a valid ISO 8601 date"}')
+        )
+
+        self.create_pages(sync.NOTION_MAX_CONSECUTIVE_FAILURES + 5)
+
+        self.assertIsNone(self.notion.create_page("db", {}))
+
+    def test_server_errors_open_circuit(self):
+        self.notion.create_session.request = mock.Mock(return_value=make_response(503, b"{}"))
+
+        with self.assertRaises(sync.CircuitOpenError):
+            self.create_pages(sync.NOTION_MAX_CONSECUTIVE_FAILURES)
+
+    def test_connection_errors_open_circuit(self):
+        self.notion.session.request = mock.Mock(side_effect=requests.exceptions.ConnectionError("down"))
+
+        with self.assertRaises(sync.CircuitOpenError):
+            for _ in range(sync.NOTION_MAX_CONSECUTIVE_FAILURES):
+                self.notion.update_page("page", {})
+
+    def test_success_resets_failure_count(self):
+        self.notion.create_session.request = mock.Mock(side_effect=(
+            [make_response(503, b"{}")] * (sync.NOTION_MAX_CONSECUTIVE_FAILURES - 1)
+            + [make_response(200, b'{"id": "page"}')]
+            + [make_response(503, b"{}")] * (sync.NOTION_MAX_CONSECUTIVE_FAILURES - 1)
+        ))
+
+        self.create_pages(2 * sync.NOTION_MAX_CONSECUTIVE_FAILURES - 1)
+
+        self.assertEqual(self.notion._consecutive_failures, sync.NOTION_MAX_CONSECUTIVE_FAILURES - 1)
+
+
+class NotionMCPCircuitTest(SyncTestCase):
+
+    def test_cli_failures_open_circuit(self):
+        notion = sync.NotionMCP(server_cmd="")
+        error = subprocess.CalledProcessError(1, "manus-mcp-cli", stderr=b"503 Service Unavailable")
+
+        with mock.patch.object(sync.subprocess, "run", side_effect=error):
+            with self.assertRaises(sync.CircuitOpenError):
+                for _ in range(sync.NOTION_MAX_CONSECUTIVE_FAILURES):
+                    notion.create_page("db", {})
+
+
+if __name__ == "__main__":
+    unittest.main()
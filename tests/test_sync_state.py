@@ -0,0 +1,106 @@
+"""Tests des ETag Axonaut et de l'état persistant entre deux synchronisations"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import orjson
+
+import sync_axonaut_notion as sync
+from tests import SyncTestCase, make_response
+
+
+class AxonautETagTest(SyncTestCase):
+
+    def test_200_stores_etag_and_count(self):
+        axonaut = sync.AxonautAPI("key")
+        axonaut.session.get = mock.Mock(return_value=make_response(200, orjson.dumps([{"id": 1}, {"id": 2}]), {"ETag": '"v1"'}))
+
+        records = list(axonaut._iter_pages("invoices", {}, 100, "factures"))
+
+        self.assertEqual([r["id"] for r in records], [1, 2])
+        self.assertEqual(axonaut.seen_etags, {"invoices?limit=100&page=1": {"etag": '"v1"', "count": 2}})
+
+    def test_304_skips_page_and_continues_pagination(self):
+        etags = {"invoices?limit=2&page=1": {"etag": '"v1"', "count": 2}}
+        axonaut = sync.AxonautAPI("key", etags=etags)
+        axonaut.session.get = mock.Mock(side_effect=[
+            make_response(304),
+            make_response(200, orjson.dumps([{"id": 3}]), {"ETag": '"v2"'}),
+        ])
+
+        records = list(axonaut._iter_pages("invoices", {}, 2, "factures"))
+
+        self.assertEqual([r["id"] for r in records], [3])
+        first_headers = axonaut.session.get.call_args_list[0].kwargs["headers"]
+        self.assertEqual(first_headers, {"page": "1", "If-None-Match": '"v1"'})
+        self.assertEqual(axonaut.session.get.call_args_list[1].kwargs["headers"], {"page": "2"})
+        self.assertEqual(axonaut.seen_etags, {
+            "invoices?limit=2&page=1": {"etag": '"v1"', "count": 2},
+            "invoices?limit=2&page=2": {"etag": '"v2"', "count": 1},
+        })
+
+
+class SyncStateTest(SyncTestCase):
+
+    DATABASES = {"invoices": "db-inv", "payments": "db-pay"}
+
+    def test_state_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sub", "state.json")
+            sync.save_state({"databases": self.DATABASES, "etags": {"k": {"etag": "e", "count": 1}}}, path)
+            self.assertEqual(sync.load_state(path)["etags"], {"k": {"etag": "e", "count": 1}})
+
+    def test_etags_discarded_when_databases_change(self):
+        state = {"databases": self.DATABASES, "etags": {"k": {"etag": "e", "count": 1}}}
+
+        self.assertEqual(sync.state_etags(state, self.DATABASES), state["etags"])
+        self.assertEqual(sync.state_etags(state, {**self.DATABASES, "invoices": "other"}), {})
+        self.assertEqual(sync.state_etags({"etags": state["etags"]}, self.DATABASES), {})
+
+    def run_main(self, create_result):
+        """Exécute main() avec une facture et un client Notion factices"""
+        invoice = sync.Invoice.from_api({"id": 1, "number": "F-1"})
+        axonaut = mock.Mock(seen_etags={"invoices?limit=100&page=1": {"etag": "e", "count": 1}})
+        axonaut.iter_invoices.return_value = iter([invoice])
+        axonaut.iter_payments.return_value = iter([])
+        notion = mock.Mock()
+        notion.find_pages.return_value = {}
+        notion.create_page.return_value = create_result
+
+        with mock.patch.multiple(
+            sync,
+            AXONAUT_API_KEY="key",
+            NOTION_TOKEN="token",
+            NOTION_INVOICES_DB_ID="db-inv",
+            NOTION_PAYMENTS_DB_ID="db-pay",
+            DRY_RUN=False,
+            setup_logging=mock.Mock(),
+            load_state=mock.Mock(return_value={}),
+            save_state=mock.Mock(),
+            AxonautAPI=mock.Mock(return_value=axonaut),
+            NotionAPI=mock.Mock(return_value=notion),
+        ):
+            with self.assertRaises(SystemExit) as exit_info:
+                sync.main()
+            return exit_info.exception.code, sync.save_state
+
+    def test_state_saved_after_successful_run(self):
+        code, save_state = self.run_main(create_result={"id": "page"})
+
+        self.assertEqual(code, 0)
+        save_state.assert_called_once_with({
+            "databases": self.DATABASES,
+            "etags": {"invoices?limit=100&page=1": {"etag": "e", "count": 1}},
+        })
+
+    def test_state_not_saved_on_failure(self):
+        code, save_state = self.run_main(create_result=None)
+
+        self.assertEqual(code, 1)
+        save_state.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()